@@ -13,38 +13,34 @@ Options:
 
 Requirements:
     - rsvg-convert (install via: brew install librsvg)
-    - PyPDF2 (install via: pip install PyPDF2)
+    - lxml (install via: pip install lxml)
 """
 
 import argparse
+import copy
 import os
 import re
-import shutil
 import subprocess
 import sys
 import tempfile
-import xml.etree.ElementTree as ET
 from pathlib import Path
 
-# Check for required tools
-def check_requirements():
-    """Check if required tools are available."""
-    # Check rsvg-convert
-    if not shutil.which('rsvg-convert'):
-        print("Error: rsvg-convert not found.")
-        print("Install it with: brew install librsvg")
-        sys.exit(1)
-    
-    # Check PyPDF2
-    try:
-        from PyPDF2 import PdfMerger
-    except ImportError:
-        print("Error: PyPDF2 not found.")
-        print("Install it with: pip install PyPDF2")
-        sys.exit(1)
+try:
+    from lxml import etree as ET
+except ImportError:
+    print("Error: lxml not found.")
+    print("Install it with: pip install lxml")
+    sys.exit(1)
+
 
-check_requirements()
-from PyPDF2 import PdfMerger
+SVG_NS = {'svg': 'http://www.w3.org/2000/svg'}
+
+# Top-level groups holding one keymap layer each, classed layer-NAME
+LAYER_CLASS_PREFIX = 'layer-'
+LAYER_XPATH = f"./svg:g[starts-with(@class, '{LAYER_CLASS_PREFIX}')]"
+
+SVG_USE = '{http://www.w3.org/2000/svg}use'
+XLINK_HREF = '{http://www.w3.org/1999/xlink}href'
 
 
 # US Letter dimensions in points (72 points per inch)
@@ -52,11 +48,15 @@ LETTER_WIDTH_PT = 612   # 8.5 inches
 LETTER_HEIGHT_PT = 792  # 11 inches
 
 
+# translate(x, y), translate(x y) or translate(x); y defaults to 0
+_TRANSLATE_RE = re.compile(r'translate\s*\(\s*(-?[0-9.]+)(?:(?:\s*,\s*|\s+)(-?[0-9.]+))?\s*\)')
+
+
 def parse_transform(transform_str):
     """Extract x, y from a translate(x, y) transform string."""
-    match = re.search(r'translate\s*\(\s*([0-9.]+)\s*,\s*([0-9.]+)\s*\)', transform_str)
+    match = _TRANSLATE_RE.search(transform_str)
     if match:
-        return float(match.group(1)), float(match.group(2))
+        return float(match.group(1)), float(match.group(2) or 0)
     return 0, 0
 
 
@@ -65,96 +65,109 @@ def get_layer_info(root):
     layers = []
     
     # Find all top-level groups with layer-* class
-    for elem in root:
-        if elem.tag.endswith('}g') or elem.tag == 'g':
-            class_name = elem.get('class', '')
-            if class_name.startswith('layer-'):
-                transform = elem.get('transform', '')
-                x, y = parse_transform(transform)
-                layer_name = class_name.replace('layer-', '')
-                layers.append({
-                    'name': layer_name,
-                    'class': class_name,
-                    'y_offset': y,
-                    'element': elem
-                })
+    for elem in root.xpath(LAYER_XPATH, namespaces=SVG_NS):
+        class_name = elem.get('class')
+        transform = elem.get('transform', '')
+        x, y = parse_transform(transform)
+        layer_name = class_name[len(LAYER_CLASS_PREFIX):]
+        layers.append({
+            'name': layer_name,
+            'class': class_name,
+            'y_offset': y,
+            'element': elem
+        })
     
     return layers
 
 
 def calculate_layer_heights(layers, total_height):
     """Calculate the height of each layer based on positions."""
-    for i, layer in enumerate(layers):
-        if i < len(layers) - 1:
-            layer['height'] = layers[i + 1]['y_offset'] - layer['y_offset']
-        else:
-            # Last layer - estimate from total height
-            layer['height'] = total_height - layer['y_offset']
+    # Each layer ends where the next begins; the last one ends at the total height
+    y_offsets = [layer['y_offset'] for layer in layers]
+    y_ends = y_offsets[1:] + [total_height]
+    for layer, y_start, y_end in zip(layers, y_offsets, y_ends):
+        layer['height'] = y_end - y_start
     return layers
 
 
-def create_page_svg(original_svg_path, svg_width, y_start, page_height, exclude_layers=None):
+def create_page_svg(root_template, svg_width, y_start, page_height, exclude_layers=None):
     """
-    Create an SVG string for a single page by modifying the viewBox.
+    Create SVG bytes for a single page by modifying the viewBox.
     
     The viewBox approach keeps all content but shows only the visible portion.
     """
-    # Register namespaces
-    ET.register_namespace('', 'http://www.w3.org/2000/svg')
-    ET.register_namespace('xlink', 'http://www.w3.org/1999/xlink')
-    
-    tree = ET.parse(original_svg_path)
-    root = tree.getroot()
-    
-    # Remove excluded layers if specified
+    # Classify excluded layers once on the template
+    excluded = set()
     if exclude_layers:
-        layers_to_remove = []
-        for elem in root:
-            if elem.tag.endswith('}g') or elem.tag == 'g':
-                class_name = elem.get('class', '')
-                if any(f'layer-{name}' == class_name for name in exclude_layers):
-                    layers_to_remove.append(elem)
-        for elem in layers_to_remove:
-            root.remove(elem)
+        exclude_set = set(exclude_layers)
+        prefix_len = len(LAYER_CLASS_PREFIX)
+        for elem in root_template.xpath(LAYER_XPATH, namespaces=SVG_NS):
+            if elem.get('class')[prefix_len:] in exclude_set:
+                excluded.add(elem)
+    
+    # Copy only the children that are kept, rather than copying everything and pruning
+    root = ET.Element(root_template.tag, root_template.attrib, nsmap=root_template.nsmap)
+    root.text = root_template.text
+    for elem in root_template:
+        if elem not in excluded:
+            root.append(copy.deepcopy(elem))
     
     # Modify viewBox to show only this page's content
     root.set('viewBox', f'0 {y_start} {svg_width} {page_height}')
     root.set('width', str(svg_width))
     root.set('height', str(page_height))
     
-    return ET.tostring(root, encoding='unicode')
+    return ET.tostring(root, encoding='utf-8', xml_declaration=True)
 
 
-def create_layer_svg(original_svg_path, svg_width, layer_info, all_layers, exclude_layers=None):
+def fit_to_page(svg_width, svg_height, page_width_pt=LETTER_WIDTH_PT, page_height_pt=LETTER_HEIGHT_PT):
+    """Return the (width, height) that fits the SVG on the page, keeping its aspect ratio."""
+    # Calculate scale to fit width while maintaining aspect ratio
+    scale = page_width_pt / svg_width
+    output_height = svg_height * scale
+    
+    # If scaled height exceeds page height, scale by height instead
+    if output_height > page_height_pt:
+        scale = page_height_pt / svg_height
+    
+    return svg_width * scale, svg_height * scale
+
+
+def create_layer_svg(svg_path, root_template, base_href, svg_width, layer_info, all_layers, exclude_layers=None,
+                     page_width_pt=LETTER_WIDTH_PT, page_height_pt=LETTER_HEIGHT_PT):
     """
-    Create an SVG string containing specific layers.
+    Write an SVG file to svg_path containing specific layers, sized to fit the page.
+    
+    Layers are drawn with <use> references into the base SVG at base_href,
+    so a page only carries the non-layer content (style, defs) and one
+    reference per layer.
+    rsvg-convert sizes each page from the root width/height, so the fitted
+    size is embedded there while the viewBox keeps the visible region.
+    
+    Returns (output_width, output_height).
     """
-    ET.register_namespace('', 'http://www.w3.org/2000/svg')
-    ET.register_namespace('xlink', 'http://www.w3.org/1999/xlink')
+    root = ET.Element(root_template.tag, root_template.attrib, nsmap=root_template.nsmap)
     
-    tree = ET.parse(original_svg_path)
-    root = tree.getroot()
+    # Keep every top-level non-layer child (style, defs, ...) so referenced
+    # layers render the same as in the base, including #id references
+    layer_elements = set(root_template.xpath(LAYER_XPATH, namespaces=SVG_NS))
+    for elem in root_template:
+        if elem not in layer_elements:
+            root.append(copy.deepcopy(elem))
     
     # Get included layer names
     included_names = set(l['name'] for l in layer_info)
     if exclude_layers:
         included_names -= set(exclude_layers)
     
-    # Remove non-included layers
-    layers_to_remove = []
-    for elem in list(root):
-        if elem.tag.endswith('}g') or elem.tag == 'g':
-            class_name = elem.get('class', '')
-            if class_name.startswith('layer-'):
-                layer_name = class_name.replace('layer-', '')
-                if layer_name not in included_names:
-                    layers_to_remove.append(elem)
-    
-    for elem in layers_to_remove:
-        root.remove(elem)
+    # Reference each included layer by the id it has in the base SVG
+    for layer in layer_info:
+        if layer['name'] in included_names:
+            ET.SubElement(root, SVG_USE, {XLINK_HREF: f"{base_href}#{layer['class']}"})
     
     # Calculate the viewBox for this page
     # Must span from first layer's y to last layer's y + height
+    total_height = float(root_template.get('height', '792'))
     if layer_info:
         y_start = layer_info[0]['y_offset']
         last_layer = layer_info[-1]
@@ -163,47 +176,40 @@ def create_layer_svg(original_svg_path, svg_width, layer_info, all_layers, exclu
         
         # Modify viewBox
         root.set('viewBox', f'0 {y_start} {svg_width} {total_height}')
-        root.set('width', str(svg_width))
-        root.set('height', str(total_height))
     
-    return ET.tostring(root, encoding='unicode')
+    output_width, output_height = fit_to_page(svg_width, total_height, page_width_pt, page_height_pt)
+    root.set('width', str(int(output_width)))
+    root.set('height', str(int(output_height)))
+    
+    ET.ElementTree(root).write(str(svg_path), encoding='utf-8', xml_declaration=True)
+    return output_width, output_height
 
 
-def svg_to_pdf(svg_content, output_path, page_width_pt=LETTER_WIDTH_PT, page_height_pt=LETTER_HEIGHT_PT):
-    """
-    Convert SVG content to PDF using rsvg-convert, scaling to fit page.
+def svg_to_pdf(svg_paths, output_path):
     """
-    # Get SVG dimensions from content
-    root = ET.fromstring(svg_content)
-    svg_width = float(root.get('width', '960'))
-    svg_height = float(root.get('height', '792'))
-    
-    # Calculate scale to fit width while maintaining aspect ratio
-    scale = page_width_pt / svg_width
-    output_height = svg_height * scale
-    
-    # If scaled height exceeds page height, scale by height instead
-    if output_height > page_height_pt:
-        scale = page_height_pt / svg_height
+    Convert page SVG files to a single multi-page PDF using rsvg-convert.
     
-    output_width = svg_width * scale
-    output_height = svg_height * scale
-    
-    # Use rsvg-convert to create PDF
+    rsvg-convert emits one PDF page per input file, so all pages are
+    rendered by a single process and no separate merge step is needed.
+    """
     cmd = [
         'rsvg-convert',
         '-f', 'pdf',
-        '-w', str(int(output_width)),
-        '-h', str(int(output_height)),
-        '-o', str(output_path)
+        '-o', str(output_path),
+        *[str(p) for p in svg_paths]
     ]
     
-    # Run rsvg-convert with SVG content as stdin
-    result = subprocess.run(
-        cmd,
-        input=svg_content.encode('utf-8'),
-        capture_output=True
-    )
+    try:
+        result = subprocess.run(
+            cmd,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE
+        )
+    except FileNotFoundError:
+        print("Error: rsvg-convert not found.")
+        print("Install it with: brew install librsvg")
+        return False
     
     if result.returncode != 0:
         print(f"Error running rsvg-convert: {result.stderr.decode()}")
@@ -258,11 +264,8 @@ def main():
     
     print(f"Reading: {input_path}")
     
-    # Parse SVG
-    ET.register_namespace('', 'http://www.w3.org/2000/svg')
-    ET.register_namespace('xlink', 'http://www.w3.org/1999/xlink')
-    
-    tree = ET.parse(input_path)
+    # Parse SVG once; every page references layers from a single copy on disk
+    tree = ET.parse(str(input_path))
     root = tree.getroot()
     
     # Get SVG dimensions
@@ -292,37 +295,38 @@ def main():
     for i in range(0, len(layers), layers_per_page):
         pages.append(layers[i:i + layers_per_page])
     
+    if not pages:
+        print("Error: No layers to render")
+        sys.exit(1)
+    
     print(f"\nGenerating {len(pages)} page(s) with up to {layers_per_page} layer(s) per page...")
     
-    # Create temporary PDF files for each page
+    # Write an SVG file for each page, then render them all at once
     with tempfile.TemporaryDirectory() as tmpdir:
-        pdf_files = []
+        # Give each layer an id so the page SVGs can reference it
+        for layer in layers:
+            layer['element'].set('id', layer['class'])
+        base_svg_name = 'base.svg'
+        tree.write(os.path.join(tmpdir, base_svg_name), encoding='utf-8', xml_declaration=True)
+        
+        svg_files = []
         
         for page_num, page_layers in enumerate(pages, 1):
-            layer_names = ', '.join(l['name'] for l in page_layers)
-            print(f"  Page {page_num}: {layer_names}")
-            
             # Create SVG for this page
-            svg_content = create_layer_svg(
-                input_path, svg_width, page_layers, layers, exclude_layers
+            tmp_svg_path = os.path.join(tmpdir, f'page_{page_num}.svg')
+            output_width, output_height = create_layer_svg(
+                tmp_svg_path, root, base_svg_name, svg_width, page_layers, layers, exclude_layers
             )
+            svg_files.append(tmp_svg_path)
             
-            # Convert to PDF
-            tmp_pdf_path = os.path.join(tmpdir, f'page_{page_num}.pdf')
-            if not svg_to_pdf(svg_content, tmp_pdf_path):
-                print(f"Error creating page {page_num}")
-                sys.exit(1)
-            
-            pdf_files.append(tmp_pdf_path)
-        
-        # Merge all pages into final PDF
-        print(f"\nMerging pages into: {output_path}")
-        merger = PdfMerger()
-        for pdf_file in pdf_files:
-            merger.append(pdf_file)
+            layer_names = ', '.join(l['name'] for l in page_layers)
+            print(f"  Page {page_num}: {layer_names} ({int(output_width)} x {int(output_height)})")
         
-        merger.write(str(output_path))
-        merger.close()
+        # Render all pages into the final PDF
+        print(f"\nRendering pages into: {output_path}")
+        if not svg_to_pdf(svg_files, output_path):
+            print("Error creating PDF")
+            sys.exit(1)
     
     print(f"\nDone! Created {output_path}")
     print(f"  - {len(pages)} page(s)")
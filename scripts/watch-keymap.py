@@ -2,22 +2,32 @@
 """
 Watch keymap files and regenerate SVG on changes.
 Cross-platform Python implementation using watchdog.
+
+Usage:
+    python scripts/watch-keymap.py [--poll]
+
+Options:
+    --poll    Poll for changes instead of using native file system events
+              (for network filesystems, where native events can be missed)
 """
 
+import argparse
+import queue
 import subprocess
 import sys
+import threading
 import time
 from datetime import datetime
 from pathlib import Path
 
 try:
     from watchdog.observers import Observer
+    from watchdog.observers.polling import PollingObserver
     from watchdog.events import FileSystemEventHandler
 except ImportError:
-    print("Installing watchdog...")
-    subprocess.check_call([sys.executable, "-m", "pip", "install", "watchdog"])
-    from watchdog.observers import Observer
-    from watchdog.events import FileSystemEventHandler
+    print("Error: watchdog not found.")
+    print("Install it with: pip install watchdog")
+    sys.exit(1)
 
 
 class Colors:
@@ -30,10 +40,12 @@ class Colors:
 
 PROJECT_ROOT = Path(__file__).parent.parent
 ZMK_KEYMAP = PROJECT_ROOT / "config" / "toucan.keymap"
-KEYMAP_YAML = PROJECT_ROOT / "keymap.yaml"
 CONFIG_YAML = PROJECT_ROOT / "config.yaml"
 OUTPUT_SVG = PROJECT_ROOT / "keymap.svg"
 
+# Quiet period after a change before regenerating, to coalesce bursts of saves
+DEBOUNCE_SECONDS = 0.5
+
 # Files to watch (relative paths for display)
 WATCH_FILES = {
     "toucan.keymap": ZMK_KEYMAP,
@@ -50,9 +62,9 @@ def generate_svg():
     print(f"{Colors.YELLOW}[{timestamp()}]{Colors.NC} Change detected, regenerating SVG...")
     
     try:
-        # Step 1: Parse ZMK keymap to YAML
+        # Step 1: Parse ZMK keymap to YAML (kept in memory, not written to disk)
         parse_result = subprocess.run(
-            ["keymap", "parse", "-z", str(ZMK_KEYMAP), "-o", str(KEYMAP_YAML)],
+            ["keymap", "parse", "-z", str(ZMK_KEYMAP)],
             cwd=PROJECT_ROOT,
             capture_output=True,
             text=True,
@@ -66,17 +78,16 @@ def generate_svg():
             return
         
         # Step 2: Fix layout (toucan uses crkbd layout)
-        yaml_content = KEYMAP_YAML.read_text()
-        yaml_content = yaml_content.replace(
+        yaml_content = parse_result.stdout.replace(
             "layout: {zmk_keyboard: toucan}",
             "layout:\n  qmk_keyboard: crkbd/rev1\n  layout_name: LAYOUT_split_3x6_3"
         )
-        KEYMAP_YAML.write_text(yaml_content)
         
-        # Step 3: Draw SVG from YAML
+        # Step 3: Draw SVG from YAML piped in on stdin
         draw_result = subprocess.run(
-            ["keymap", "-c", str(CONFIG_YAML), "draw", str(KEYMAP_YAML), "-o", str(OUTPUT_SVG)],
+            ["keymap", "-c", str(CONFIG_YAML), "draw", "-", "-o", str(OUTPUT_SVG)],
             cwd=PROJECT_ROOT,
+            input=yaml_content,
             capture_output=True,
             text=True,
         )
@@ -95,12 +106,29 @@ def generate_svg():
         print()
 
 
+def regenerate_worker(pending):
+    """Regenerate the SVG once per burst of queued change notifications"""
+    while True:
+        pending.get()
+        
+        # Wait for the burst to settle, then drop anything queued meanwhile
+        time.sleep(DEBOUNCE_SECONDS)
+        try:
+            while True:
+                pending.get_nowait()
+        except queue.Empty:
+            pass
+        
+        generate_svg()
+
+
 class KeymapHandler(FileSystemEventHandler):
     """Handle file system events for keymap files"""
     
-    def __init__(self):
-        self.last_modified = 0
-        self.debounce_seconds = 0.5
+    def __init__(self, pending):
+        self.pending = pending
+        # Resolve once; each event then costs a single resolve and set lookup
+        self.watched = frozenset(path.resolve() for path in WATCH_FILES.values())
     
     def on_modified(self, event):
         if event.is_directory:
@@ -109,25 +137,28 @@ class KeymapHandler(FileSystemEventHandler):
         event_path = Path(event.src_path)
         
         # Check if modified file is one we care about
-        should_trigger = False
-        for watch_path in WATCH_FILES.values():
-            if event_path.resolve() == watch_path.resolve():
-                should_trigger = True
-                break
-        
-        if not should_trigger:
-            return
-        
-        # Debounce rapid changes
-        current_time = time.time()
-        if current_time - self.last_modified < self.debounce_seconds:
+        if event_path.resolve() not in self.watched:
             return
-        self.last_modified = current_time
         
-        generate_svg()
+        # Hand off to the worker; a full queue already has a regeneration pending
+        try:
+            self.pending.put_nowait(event_path)
+        except queue.Full:
+            pass
 
 
 def main():
+    parser = argparse.ArgumentParser(
+        description="Watch keymap files and regenerate SVG on changes."
+    )
+    parser.add_argument(
+        "--poll",
+        action="store_true",
+        help="Poll for changes instead of using native file system events"
+    )
+    
+    args = parser.parse_args()
+    
     print(f"{Colors.CYAN}╔════════════════════════════════════════════╗{Colors.NC}")
     print(f"{Colors.CYAN}║     Keymap SVG Watcher - Toucan Keyboard   ║{Colors.NC}")
     print(f"{Colors.CYAN}╚════════════════════════════════════════════╝{Colors.NC}")
@@ -144,16 +175,21 @@ def main():
     print(f"{Colors.CYAN}Press Ctrl+C to stop watching{Colors.NC}")
     print()
     
+    # Regenerate on a worker thread so event delivery never waits on keymap-drawer
+    pending = queue.Queue(maxsize=1)
+    threading.Thread(target=regenerate_worker, args=(pending,), daemon=True).start()
+    
     # Set up file watchers for both directories
-    event_handler = KeymapHandler()
-    observer = Observer()
+    event_handler = KeymapHandler(pending)
+    observer = PollingObserver() if args.poll else Observer()
     observer.schedule(event_handler, str(PROJECT_ROOT), recursive=False)
     observer.schedule(event_handler, str(PROJECT_ROOT / "config"), recursive=False)
     observer.start()
     
+    # The main thread only waits for Ctrl+C, which interrupts the sleep
     try:
         while True:
-            time.sleep(1)
+            time.sleep(60)
     except KeyboardInterrupt:
         print()
         print(f"{Colors.CYAN}Stopping watcher...{Colors.NC}")
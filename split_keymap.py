@@ -1,24 +1,25 @@
 #!/usr/bin/env python3
 """Split keymap SVG into multiple pages with 3 keymaps per page."""
 
-import xml.etree.ElementTree as ET
+import copy
+
+from lxml import etree as ET
 
 # Read the original SVG
 tree = ET.parse('keymap.svg')
 root = tree.getroot()
 
 # Extract the style element and namespace
-ns = {'svg': 'http://www.w3.org/2000/svg'}
+SVG_NAMESPACE = 'http://www.w3.org/2000/svg'
+XLINK_NAMESPACE = 'http://www.w3.org/1999/xlink'
+ns = {'svg': SVG_NAMESPACE}
 style = root.find('svg:style', ns)
 
-# Find all layer groups
-layers = []
-for elem in root.findall('.//svg:g[@class]', ns):
-    class_name = elem.get('class', '')
-    if 'layer-' in class_name:
-        # Skip COLEMAK layer
-        if 'layer-COLEMAK' not in class_name:
-            layers.append(elem)
+# Find all layer groups, skipping the COLEMAK layer
+layers = root.xpath(
+    ".//svg:g[contains(@class, 'layer-') and not(contains(@class, 'layer-COLEMAK'))]",
+    namespaces=ns
+)
 
 print(f"Found {len(layers)} layers (excluding COLEMAK)")
 
@@ -38,23 +39,21 @@ layer_spacing = 350  # approximate spacing from original
 # Create separate SVG files for each page
 for page_num, page_layers in enumerate(pages, 1):
     # Create new SVG root
-    new_root = ET.Element('svg', {
+    new_root = ET.Element(f'{{{SVG_NAMESPACE}}}svg', {
         'width': str(page_width),
         'height': str(page_height),
         'viewBox': f'0 0 {page_width} {page_height}',
         'class': 'keymap',
-        'xmlns': 'http://www.w3.org/2000/svg',
-        'xmlns:xlink': 'http://www.w3.org/1999/xlink'
-    })
+    }, nsmap={None: SVG_NAMESPACE, 'xlink': XLINK_NAMESPACE})
     
-    # Add style
+    # Add style (copied, since lxml moves appended elements)
     if style is not None:
-        new_root.append(style)
+        new_root.append(copy.deepcopy(style))
     
     # Add layers with adjusted y positions
     for idx, layer in enumerate(page_layers):
         # Clone the layer
-        new_layer = ET.fromstring(ET.tostring(layer))
+        new_layer = copy.deepcopy(layer)
         
         # Get original transform
         transform = new_layer.get('transform', '')